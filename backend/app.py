@@ -1,27 +1,59 @@
 # backend/app.py (Pinecone NEW Version)
 import os, io, uuid
-from typing import List, Optional
+
+# Size the inference thread pools per worker before ORT/torch/tokenizers are imported;
+# otherwise every gunicorn worker spawns one thread per core and they thrash the caches
+INFERENCE_THREADS = max(1, (os.cpu_count() or 4) // int(os.getenv("WEB_CONCURRENCY", "1")))
+os.environ.setdefault("OMP_NUM_THREADS", str(INFERENCE_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(INFERENCE_THREADS))
+os.environ.setdefault("MKL_DYNAMIC", "FALSE")
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+# gRPC only tolerates fork() with fork support on (and a poll strategy that
+# implements it). The PDF/chunking pool starts from a forkserver, so workers
+# don't fork while holding the Pinecone channel; this guards any other fork.
+os.environ.setdefault("GRPC_ENABLE_FORK_SUPPORT", "true")
+os.environ.setdefault("GRPC_POLL_STRATEGY", "poll")
+
+import asyncio
+import hashlib
+import mmap
+import multiprocessing
+import sqlite3
+import threading
+import zipfile
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Optional, Tuple
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
+from anyio import CapacityLimiter
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from pinecone import Pinecone, ServerlessSpec
-from sentence_transformers import SentenceTransformer
-from PyPDF2 import PdfReader
-from docx import Document
+try:
+    # gRPC data plane: binary float32 payloads and multiplexed requests over one channel
+    from pinecone.grpc import PineconeGRPC
+except ImportError:
+    PineconeGRPC = None
+try:
+    import jwt
+    _HAS_JWT = True
+except ImportError:
+    _HAS_JWT = False
+try:
+    import orjson  # noqa: F401  (ORJSONResponse needs it installed)
+    FastJSONResponse = ORJSONResponse
+except ImportError:
+    FastJSONResponse = JSONResponse
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import re
-import nltk
-
-
-# Download NLTK data on startup
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    print("Downloading NLTK punkt data...")
-    nltk.download('punkt', quiet=True)
-    print("NLTK punkt data downloaded successfully!")
+import numpy as np
+from text_processing import FITZ_LOCK, fitz, _extract_pdf_pages, chunk_document
 
 # Load env
 load_dotenv()
@@ -29,6 +61,31 @@ PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "rag-documents")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+# Allowance for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+UPLOAD_COPY_BUFFER = 1 << 20
+# Documents extracted/chunked/embedded at once per worker
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "2"))
+# Pinecone caps upsert requests at 2MB; 100 vectors with chunk text stays well under it
+UPSERT_BATCH_SIZE = 100
+# Upsert requests in flight at once across the worker, to stay inside Pinecone rate limits
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY", "8"))
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "emb_cache.db")
+DOCUMENTS_DB_PATH = os.getenv("DOCUMENTS_DB_PATH", "documents.db")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "onnx_model")
+USE_ONNX = os.getenv("USE_ONNX", "true").lower() in ("1", "true", "yes")
+# Set by gunicorn.conf.py under preload_app: the master only checks/creates the
+# index, and each worker opens its own data-plane connection in reset_process_state
+PINECONE_CONNECT_AFTER_FORK = os.getenv("PINECONE_CONNECT_AFTER_FORK", "").lower() in ("1", "true", "yes")
+# Processes in each worker's PDF/chunking pool; gunicorn already runs one worker
+# per core, so the default splits the cores between workers like the model threads
+CPU_POOL_WORKERS = max(1, int(os.getenv("CPU_POOL_WORKERS", str(INFERENCE_THREADS))))
+# Tokens past this are truncated. The default 256 is all-MiniLM-L6-v2's own limit, so this
+# is a no-op unless overridden (e.g. lowered for cheaper attention, or for a model whose
+# native limit is longer - ~800-char chunks rarely need more than 256 tokens)
+EMBEDDING_MAX_SEQ_LENGTH = int(os.getenv("EMBEDDING_MAX_SEQ_LENGTH", "256"))
 
 # Create upload directory
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -36,6 +93,57 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 # FastAPI app
 app = FastAPI(title="RAG Ingest + Query (Pinecone + Auth)")
 
+class UploadSizeLimitMiddleware:
+    """Reject oversized /ingest bodies before Starlette spools them.
+
+    FastAPI parses the whole multipart body before the endpoint runs, so the
+    cap is enforced here: up front from Content-Length, and while the body
+    streams in for chunked or mislabelled requests.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/ingest":
+            await self.app(scope, receive, send)
+            return
+
+        too_large = JSONResponse(
+            {"success": False, "error": "File too large. Maximum size is 50MB."},
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await too_large(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            return message
+
+        async def guarded_send(message):
+            # Whatever the app answers to an aborted body is replaced by the 413 above
+            if not exceeded:
+                await send(message)
+            elif message["type"] == "http.response.start":
+                await too_large(scope, receive, send)
+
+        await self.app(scope, limited_receive, guarded_send)
+
+# Added before CORS so the 413 still goes out with CORS headers
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -52,9 +160,11 @@ app.add_middleware(
 
 
 #  NEW PINEcone INITIALIZATION
+# Same API either way; the gRPC client only changes the data-plane transport
+PineconeClient = PineconeGRPC or Pinecone
 try:
-    pc = Pinecone(api_key=PINECONE_API_KEY)
-    print(" Pinecone client initialized successfully!")
+    pc = PineconeClient(api_key=PINECONE_API_KEY)
+    print(f" Pinecone client initialized successfully! ({'gRPC' if PineconeGRPC else 'REST'})")
     
     # Check if index exists, create if not
     existing_indexes = pc.list_indexes().names()
@@ -70,25 +180,350 @@ try:
             )
         )
         # Wait for index to be ready
-        import time
         time.sleep(1)
     
-    # Connect to index
-    index = pc.Index(PINECONE_INDEX_NAME)
-    print(" Pinecone index connected successfully!")
+    # Connect to index (a gRPC channel must not be opened before gunicorn forks)
+    if PINECONE_CONNECT_AFTER_FORK:
+        index = None
+        print(" Pinecone index ready; workers connect after fork")
+    else:
+        index = pc.Index(PINECONE_INDEX_NAME)
+        print(" Pinecone index connected successfully!")
     
 except Exception as e:
     print(f" Pinecone initialization failed: {e}")
     pc = None
     index = None
 
+@lru_cache(maxsize=1024)
+def _user_filter(user_id: str) -> dict:
+    """Pinecone metadata filter for one user's vectors; shared, so never mutate it"""
+    return {"user_id": {"$eq": user_id}}
+
+#  ONNX Runtime embedding backend (int8, CPU)
+# The model is exported at build time by export_onnx.py; serving only loads it
+from export_onnx import ONNX_QUANTIZED_FILE
+
+class ORTSentenceEncoder:
+    """Drop-in replacement for SentenceTransformer.encode backed by ONNX Runtime.
+
+    Mean-pools the token embeddings over the attention mask and optionally
+    L2-normalizes, matching the all-MiniLM-L6-v2 pooling configuration.
+    """
+
+    def __init__(self, model_dir: str, max_seq_length: int = 256):
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+        self.model_path = os.path.join(model_dir, ONNX_QUANTIZED_FILE)
+        self.open_session()
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_seq_length = max_seq_length
+
+    def open_session(self) -> None:
+        """(Re)create the inference session; ORT thread pools do not survive fork()"""
+        import onnxruntime as ort
+
+        sess_options = ort.SessionOptions()
+        # Fuse attention/GELU/LayerNorm subgraphs into single kernels
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sess_options.intra_op_num_threads = INFERENCE_THREADS
+        sess_options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            self.model_path,
+            sess_options=sess_options,
+            providers=["CPUExecutionProvider"],
+        )
+
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = False) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        outputs = []
+        for start in range(0, len(sentences), batch_size):
+            encoded = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(pooled.astype(np.float32, copy=False))
+
+        embeddings = np.concatenate(outputs) if outputs else np.empty((0, 384), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+def load_onnx_encoder() -> Optional[ORTSentenceEncoder]:
+    """Load the exported model, or None when it has not been built"""
+    if not os.path.exists(os.path.join(ONNX_MODEL_DIR, ONNX_QUANTIZED_FILE)):
+        return None
+    return ORTSentenceEncoder(ONNX_MODEL_DIR, max_seq_length=EMBEDDING_MAX_SEQ_LENGTH)
+
 #  Initialize Embedding Model
-try:
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-    print(" Embedding model loaded successfully!")
-except Exception as e:
-    print(f" Embedding model loading failed: {e}")
-    embedding_model = None
+embedding_model = None
+embedding_backend = None
+if USE_ONNX:
+    try:
+        embedding_model = load_onnx_encoder()
+        if embedding_model is None:
+            print(f" WARNING: no ONNX model in {ONNX_MODEL_DIR}/ (run `python export_onnx.py` "
+                  "at build time); falling back to PyTorch")
+        else:
+            embedding_backend = "onnx-int8"
+            print(" ONNX Runtime embedding model loaded successfully!")
+    except Exception as e:
+        print(f" WARNING: ONNX Runtime model failed to load, falling back to PyTorch: {e}")
+        embedding_model = None
+
+if embedding_model is None:
+    try:
+        # torch is only imported on this fallback path; the ONNX backend never loads it
+        import torch
+        torch.set_num_threads(INFERENCE_THREADS)
+        torch.set_num_interop_threads(1)
+        from sentence_transformers import SentenceTransformer
+        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        embedding_model.max_seq_length = EMBEDDING_MAX_SEQ_LENGTH
+        embedding_backend = "torch"
+        print(" Embedding model loaded successfully!")
+    except Exception as e:
+        print(f" Embedding model loading failed: {e}")
+        embedding_model = None
+
+# int8 vectors differ slightly from fp32 ones, and truncation changes long chunks,
+# so cache entries are per backend and sequence length
+EMBEDDING_CACHE_KEY = f"{EMBEDDING_MODEL_NAME}:{embedding_backend}:{EMBEDDING_MAX_SEQ_LENGTH}"
+
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "mmap_size=268435456",
+    "cache_size=-131072",
+)
+
+def open_sqlite(path: str) -> sqlite3.Connection:
+    """Open a SQLite store shared by the request threads and the gunicorn workers"""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    # WAL + NORMAL drops the per-commit fsync; only the newest commits are at risk on power loss
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma}")
+    return conn
+
+#  Persistent embedding cache: (sha256(chunk), model) -> int8 vector
+# Re-uploads and shared boilerplate across documents skip the encoder entirely.
+# Each vector is scaled so its largest component is +-127 and stored as int8:
+# 384 bytes per row instead of 1536. Decoding re-normalizes to unit length
+# (cosine similarity to the fp32 vector > 0.999), and get_embeddings passes fresh
+# vectors through the same round trip, so what reaches Pinecone never depends on
+# whether a chunk was cached.
+def quantize_int8(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    peaks = np.abs(vectors).max(axis=1, keepdims=True)
+    peaks[peaks == 0] = 1.0
+    return np.rint(vectors * (127.0 / peaks)).astype(np.int8)
+
+def dequantize_int8(quantized: np.ndarray) -> np.ndarray:
+    vectors = quantized.astype(np.float32)
+    return vectors / np.clip(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12, None)
+
+def open_embed_cache() -> Optional[sqlite3.Connection]:
+    try:
+        conn = open_sqlite(EMBED_CACHE_PATH)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS emb_cache ("
+            "hash BLOB NOT NULL, model TEXT NOT NULL, vec BLOB NOT NULL, "
+            "PRIMARY KEY (hash, model))"
+        )
+        conn.commit()
+        print(" Embedding cache opened successfully!")
+        return conn
+    except Exception as e:
+        print(f" Embedding cache unavailable: {e}")
+        return None
+
+_embed_cache = open_embed_cache()
+_embed_cache_lock = threading.Lock()
+# Rows in older formats (float32, or int8 with a scale prefix) sit under other keys
+EMBED_CACHE_MODEL_KEY = f"{EMBEDDING_CACHE_KEY}:int8-unit"
+
+# SQLite caps bound parameters per statement; stay well below the limit
+_CACHE_LOOKUP_BATCH = 500
+
+def _cache_lookup(hashes: List[bytes]) -> dict:
+    """Return {hash: vector} for every hash already in the embedding cache"""
+    found = {}
+    if _embed_cache is None or not hashes:
+        return found
+    unique = list(dict.fromkeys(hashes))
+    with _embed_cache_lock:
+        for i in range(0, len(unique), _CACHE_LOOKUP_BATCH):
+            batch = unique[i:i + _CACHE_LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = _embed_cache.execute(
+                f"SELECT hash, vec FROM emb_cache WHERE model = ? AND hash IN ({placeholders})",
+                [EMBED_CACHE_MODEL_KEY, *batch],
+            ).fetchall()
+            if rows:
+                vectors = dequantize_int8(
+                    np.stack([np.frombuffer(vec, dtype=np.int8) for _, vec in rows])
+                )
+                found.update(zip((h for h, _ in rows), vectors))
+    return found
+
+def _cache_store(hashes: List[bytes], quantized: np.ndarray) -> None:
+    """Write freshly computed (already int8-quantized) vectors back to the embedding cache"""
+    if _embed_cache is None or not hashes:
+        return
+    rows = [(h, EMBED_CACHE_MODEL_KEY, q.tobytes()) for h, q in zip(hashes, quantized)]
+    try:
+        with _embed_cache_lock:
+            _embed_cache.executemany(
+                "INSERT OR REPLACE INTO emb_cache (hash, model, vec) VALUES (?, ?, ?)", rows
+            )
+            _embed_cache.commit()
+    except Exception as e:
+        print(f"Embedding cache write failed: {e}")
+
+#  Document registry: per-file fields live here once instead of on every chunk vector.
+# Pinecone metadata only keeps what filtering and display of a chunk need.
+def open_document_registry() -> Optional[sqlite3.Connection]:
+    try:
+        conn = open_sqlite(DOCUMENTS_DB_PATH)
+        conn.row_factory = sqlite3.Row
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "document_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, source TEXT NOT NULL, "
+            "username TEXT, file_path TEXT, upload_time TEXT, chunking_method TEXT, "
+            "chunk_count INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS documents_user ON documents (user_id)")
+        # Users whose pre-registry documents have already been copied in from Pinecone
+        conn.execute("CREATE TABLE IF NOT EXISTS backfilled_users (user_id TEXT PRIMARY KEY)")
+        # Bumped whenever a user's vectors change; every worker's query cache checks it
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_generations ("
+            "user_id TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+        )
+        conn.commit()
+        print(" Document registry opened successfully!")
+        return conn
+    except Exception as e:
+        print(f" Document registry unavailable: {e}")
+        return None
+
+_documents_db = open_document_registry()
+_documents_db_lock = threading.Lock()
+
+def register_document(document: dict) -> None:
+    """Insert (or replace) one document's shared fields"""
+    if _documents_db is None:
+        return
+    columns = ", ".join(document)
+    placeholders = ", ".join("?" * len(document))
+    with _documents_db_lock:
+        _documents_db.execute(
+            f"INSERT OR REPLACE INTO documents ({columns}) VALUES ({placeholders})",
+            list(document.values()),
+        )
+        _documents_db.commit()
+
+def lookup_documents(user_id: str, document_ids: List[str]) -> dict:
+    """Return {document_id: row dict} for the user's documents among ``document_ids``"""
+    unique = [d for d in dict.fromkeys(document_ids) if d]
+    if _documents_db is None or not unique:
+        return {}
+    placeholders = ",".join("?" * len(unique))
+    with _documents_db_lock:
+        rows = _documents_db.execute(
+            f"SELECT * FROM documents WHERE user_id = ? AND document_id IN ({placeholders})",
+            [user_id, *unique],
+        ).fetchall()
+    return {row["document_id"]: dict(row) for row in rows}
+
+def list_user_documents(user_id: str) -> List[dict]:
+    """All of the user's registered documents, oldest upload first"""
+    if _documents_db is None:
+        return []
+    with _documents_db_lock:
+        rows = _documents_db.execute(
+            "SELECT * FROM documents WHERE user_id = ? ORDER BY upload_time", (user_id,)
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+def user_generation(user_id: str) -> int:
+    """Current version of the user's indexed data, shared by all gunicorn workers"""
+    if _documents_db is None:
+        return 0
+    with _documents_db_lock:
+        row = _documents_db.execute(
+            "SELECT generation FROM user_generations WHERE user_id = ?", (user_id,)
+        ).fetchone()
+    return row["generation"] if row else 0
+
+def bump_user_generation(user_id: str) -> None:
+    if _documents_db is None:
+        return
+    with _documents_db_lock:
+        _documents_db.execute(
+            "INSERT INTO user_generations (user_id, generation) VALUES (?, 1) "
+            "ON CONFLICT(user_id) DO UPDATE SET generation = generation + 1",
+            (user_id,),
+        )
+        _documents_db.commit()
+
+def user_backfilled(user_id: str) -> bool:
+    with _documents_db_lock:
+        row = _documents_db.execute(
+            "SELECT 1 FROM backfilled_users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+    return row is not None
+
+def backfill_documents(user_id: str, documents: List[dict]) -> None:
+    """Add pre-registry documents and mark the user done, in one transaction.
+
+    Rows already registered (e.g. by a concurrent /ingest) are left untouched.
+    """
+    with _documents_db_lock:
+        for document in documents:
+            columns = ", ".join(document)
+            placeholders = ", ".join("?" * len(document))
+            _documents_db.execute(
+                f"INSERT OR IGNORE INTO documents ({columns}) VALUES ({placeholders})",
+                list(document.values()),
+            )
+        _documents_db.execute(
+            "INSERT OR IGNORE INTO backfilled_users (user_id) VALUES (?)", (user_id,)
+        )
+        _documents_db.commit()
+
+def delete_user_documents(user_id: str) -> None:
+    if _documents_db is None:
+        return
+    with _documents_db_lock:
+        _documents_db.execute("DELETE FROM documents WHERE user_id = ?", (user_id,))
+        _documents_db.commit()
+
+def enrich_metadata(metadata: dict, documents: dict) -> dict:
+    """Merge a chunk's slim Pinecone metadata with its document's registry row.
+
+    Vectors ingested before the registry existed still carry the shared
+    fields themselves, so they pass through unchanged.
+    """
+    document = documents.get(metadata.get("document_id"))
+    if not document:
+        return metadata
+    shared = {k: v for k, v in document.items() if k != "chunk_count" and v is not None}
+    return {**shared, **metadata}
 
 # JWT implementation (same as before)
 security = HTTPBearer()
@@ -97,35 +532,34 @@ class TokenData(BaseModel):
     user_id: str
     username: str
 
+_JWT_ALGS = ["HS256"]
+
 def create_jwt_token(user_id: str, username: str) -> str:
     """Create JWT token"""
-    try:
-        import jwt
-        expiration = datetime.utcnow() + timedelta(hours=24)
-        payload = {
-            "user_id": user_id,
-            "username": username,
-            "exp": expiration
-        }
-        return jwt.encode(payload, JWT_SECRET_KEY, algorithm="HS256")
-    except ImportError:
+    if not _HAS_JWT:
         return f"simple-token-{user_id}-{username}"
+    expiration = datetime.utcnow() + timedelta(hours=24)
+    payload = {
+        "user_id": user_id,
+        "username": username,
+        "exp": expiration
+    }
+    return jwt.encode(payload, JWT_SECRET_KEY, algorithm=_JWT_ALGS[0])
 
 def verify_jwt_token(token: str) -> TokenData:
     """Verify JWT token"""
-    try:
-        import jwt
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=["HS256"])
-        return TokenData(
-            user_id=payload.get("user_id", "unknown"),
-            username=payload.get("username", "unknown")
-        )
-    except ImportError:
+    if not _HAS_JWT:
         if token.startswith("simple-token-"):
             parts = token.split("-")
             if len(parts) >= 4:
                 return TokenData(user_id=parts[2], username=parts[3])
         raise HTTPException(status_code=401, detail="Invalid token")
+    try:
+        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=_JWT_ALGS)
+        return TokenData(
+            user_id=payload.get("user_id", "unknown"),
+            username=payload.get("username", "unknown")
+        )
     except Exception as e:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
@@ -158,98 +592,425 @@ async def get_current_user_info(current_user: TokenData = Depends(get_current_us
     return current_user
 
 # Text processing functions (same as before)
-def extract_text_from_pdf(file_bytes: bytes) -> str:
-    reader = PdfReader(io.BytesIO(file_bytes))
-    return "\n".join([p.extract_text() for p in reader.pages if p.extract_text()])
+# CPU-bound ingest stages (PDF page extraction, sentence chunking of large texts)
+# fan out to a process pool so concurrent uploads don't serialize on the GIL
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "8"))
+CHUNK_PARALLEL_MIN_CHARS = int(os.getenv("CHUNK_PARALLEL_MIN_CHARS", "200000"))
+_cpu_pool: Optional[ProcessPoolExecutor] = None
+_cpu_pool_lock = threading.Lock()
 
-def extract_text_from_docx(file_bytes: bytes) -> str:
-    doc = Document(io.BytesIO(file_bytes))
-    return "\n".join([p.text for p in doc.paragraphs])
+def get_cpu_pool() -> ProcessPoolExecutor:
+    """Create the worker pool on first use so idle workers never start it.
 
-def extract_text_from_file(filename: str, file_bytes: bytes) -> str:
+    Children come from a forkserver rather than fork(): this process runs
+    threads (threadpool, ONNX Runtime, gRPC) whose locks a forked child could
+    inherit mid-acquire. The server preloads only text_processing, so
+    children never import the model or Pinecone.
+    """
+    global _cpu_pool
+    with _cpu_pool_lock:
+        if _cpu_pool is None:
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(["text_processing"])
+            _cpu_pool = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS, mp_context=ctx)
+        return _cpu_pool
+
+def _extract_pdf(path: str, use_mupdf: bool) -> str:
+    if use_mupdf:
+        # Concurrent ingests run this in different threadpool threads; every
+        # fitz call in this process goes through FITZ_LOCK
+        with FITZ_LOCK, fitz.open(path) as doc:
+            n = len(doc)
+            if n < PDF_PARALLEL_MIN_PAGES or CPU_POOL_WORKERS <= 1:
+                texts = [doc.load_page(i).get_text("text") for i in range(n)]
+                return "\n".join(t for t in texts if t)
+    else:
+        # Fallback only: PyPDF2 is imported the first time a worker needs it
+        from PyPDF2 import PdfReader
+        reader = PdfReader(path)
+        n = len(reader.pages)
+        if n < PDF_PARALLEL_MIN_PAGES or CPU_POOL_WORKERS <= 1:
+            return "\n".join(t for t in (reader.pages[i].extract_text() for i in range(n)) if t)
+    # One contiguous range per pool process: each parses the document once, not once per page
+    step = -(-n // CPU_POOL_WORKERS)
+    args = [(path, start, min(start + step, n), use_mupdf) for start in range(0, n, step)]
+    texts = (t for pages in get_cpu_pool().map(_extract_pdf_pages, args) for t in pages)
+    return "\n".join(t for t in texts if t)
+
+# Extractors read the saved upload from disk; workers re-open it by path
+# instead of receiving a pickled copy of the document
+def extract_text_from_pdf(path: str) -> str:
+    """Extract text with PyMuPDF (C, much faster), falling back to PyPDF2"""
+    if fitz is None:
+        return _extract_pdf(path, use_mupdf=False)
+    try:
+        return _extract_pdf(path, use_mupdf=True)
+    except Exception as e:
+        print(f"PyMuPDF extraction failed, falling back to PyPDF2: {e}")
+        return _extract_pdf(path, use_mupdf=False)
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# Run-level elements rendered as whitespace, as python-docx's Paragraph.text does
+_DOCX_RUN_BREAKS = {f"{_W}tab": "\t", f"{_W}br": "\n", f"{_W}cr": "\n"}
+
+def extract_text_from_docx(path: str) -> str:
+    """Read run text straight out of word/document.xml; lxml walks the tree in C"""
+    from lxml import etree  # deferred: only DOCX uploads need it
+    # Uploads are untrusted: never expand entities or load DTDs, or a crafted
+    # document could pull server files (.env, /etc/passwd) into its text.
+    # Parsers are not thread-safe, so each call builds its own.
+    parser = etree.XMLParser(resolve_entities=False, no_network=True, load_dtd=False)
+    with zipfile.ZipFile(path) as z:
+        body = etree.fromstring(z.read("word/document.xml"), parser)
+    # Word never writes a DOCTYPE; one here can only be an entity-injection attempt
+    if body.getroottree().docinfo.doctype:
+        raise ValueError("DOCX document.xml must not declare a DOCTYPE")
+    run_tag = f"{_W}r"
+    paragraphs = []
+    for p in body.iter(f"{_W}p"):
+        parts = []
+        for el in p.iter(f"{_W}t", *_DOCX_RUN_BREAKS):
+            # Only run content counts (w:tab also defines tab stops in w:pPr), and
+            # items owned by a nested paragraph (e.g. text boxes) are visited with it
+            if el.getparent().tag != run_tag or next(el.iterancestors(f"{_W}p")) is not p:
+                continue
+            parts.append(_DOCX_RUN_BREAKS.get(el.tag, el.text or ""))
+        paragraphs.append("".join(parts))
+    return "\n".join(paragraphs)
+
+def extract_text_from_file(filename: str, path: str) -> str:
     fname = filename.lower()
     if fname.endswith(".pdf"):
-        return extract_text_from_pdf(file_bytes)
+        return extract_text_from_pdf(path)
     if fname.endswith(".docx"):
-        return extract_text_from_docx(file_bytes)
-    try:
-        return file_bytes.decode("utf-8")
-    except Exception:
-        return file_bytes.decode("latin-1", errors="ignore")
-
-def chunk_text(text: str, chunk_size: int = 800, overlap: int = 150) -> List[str]:
-    text = text.replace("\r\n", "\n")
-    chunks = []
-    start = 0
-    L = len(text)
-    while start < L:
-        end = start + chunk_size
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        start = end - overlap
-    return chunks
-
-def smart_sentence_chunk(text: str, sentences_per_chunk: int = 5, overlap_sentences: int = 2) -> List[str]:
+        return extract_text_from_docx(path)
+    # Decode straight from a read-only mapping of the saved upload instead of
+    # reading it into an intermediate bytes copy first
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            try:
+                return str(mm, "utf-8")
+            except UnicodeDecodeError:
+                return str(mm, "latin-1", "ignore")
+
+#  PINEcone EMBEDDING FUNCTIONS
+def get_embeddings(texts: List[str]) -> np.ndarray:
+    """Generate float32 embeddings (one row per text) using local model for Pinecone"""
+    if not embedding_model:
+        raise HTTPException(status_code=500, detail="Embedding model not available")
+    
+    if not texts:
+        return np.empty((0, 384), dtype=np.float32)
+    
     try:
-        try:
-            nltk.data.find('tokenizers/punkt')
-        except LookupError:
-            nltk.download('punkt', quiet=True)
-        
-        sentences = nltk.tokenize.sent_tokenize(text)
-        sentences = [s.strip() for s in sentences if s.strip()]
-        
-        if len(sentences) <= 1:
-            return chunk_text(text)
+        hashes = [hashlib.sha256(t.encode("utf-8")).digest() for t in texts]
+        cached = _cache_lookup(hashes)
+        # One index per distinct missing text: duplicates are encoded once and fanned out
+        first_index = {}
+        for i, h in enumerate(hashes):
+            if h not in cached:
+                first_index.setdefault(h, i)
+        miss_indices = list(first_index.values())
         
-        chunks = []
-        i = 0
-        
-        while i < len(sentences):
-            end_idx = min(i + sentences_per_chunk, len(sentences))
-            chunk_sentences = sentences[i:end_idx]
-            chunk = " ".join(chunk_sentences)
-            chunks.append(chunk)
-            i += (sentences_per_chunk - overlap_sentences)
-            if i >= len(sentences):
-                break
-        
-        return chunks
+        if miss_indices:
+            # Length-sorted ("smart") batching: similar-length chunks share a
+            # mini-batch, so little compute is wasted on padding tokens
+            order = np.argsort([len(texts[i]) for i in miss_indices], kind="stable")
+            sorted_embs = embedding_model.encode(
+                [texts[miss_indices[j]] for j in order],
+                batch_size=64,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+            )
+            quantized = np.empty((len(miss_indices), sorted_embs.shape[1]), dtype=np.int8)
+            quantized[order] = quantize_int8(sorted_embs)
+            miss_hashes = [hashes[i] for i in miss_indices]
+            _cache_store(miss_hashes, quantized)
+            # Return exactly what a later cache hit would, so re-ingesting a document
+            # upserts the same vectors as its first ingest
+            cached.update(zip(miss_hashes, dequantize_int8(quantized)))
         
+        return np.stack([cached[h] for h in hashes]).astype(np.float32, copy=False)
     except Exception as e:
-        print(f"Sentence chunking failed, using fallback: {e}")
-        return chunk_text(text)
-
-def smart_chunk_text(text: str, method: str = "sentence", **kwargs) -> List[str]:
-    if method == "sentence":
-        return smart_sentence_chunk(text, **kwargs)
-    else:
-        return chunk_text(text, **kwargs)
+        raise HTTPException(status_code=500, detail=f"Embedding generation failed: {str(e)}")
 
-#  PINEcone EMBEDDING FUNCTIONS
-def get_embeddings(texts: List[str]) -> List[List[float]]:
-    """Generate embeddings using local model for Pinecone"""
+def get_query_embedding(query: str) -> np.ndarray:
+    """Generate the 1-D embedding for a single query, without list wrapping"""
     if not embedding_model:
         raise HTTPException(status_code=500, detail="Embedding model not available")
     
     try:
-        embeddings = embedding_model.encode(texts)
-        return embeddings.tolist()
+        embedding = embedding_model.encode(
+            query,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        return np.asarray(embedding, dtype=np.float32)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Embedding generation failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Query embedding failed: {str(e)}")
 
-def get_query_embedding(query: str) -> List[float]:
-    """Generate embedding for a single query"""
+def get_query_embeddings(queries: List[str]) -> np.ndarray:
+    """Generate embeddings for a batch of queries in one forward pass"""
     if not embedding_model:
         raise HTTPException(status_code=500, detail="Embedding model not available")
     
     try:
-        embedding = embedding_model.encode([query])
-        return embedding[0].tolist()
+        embeddings = embedding_model.encode(
+            queries,
+            batch_size=len(queries),
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        return np.asarray(embeddings, dtype=np.float32)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query embedding failed: {str(e)}")
 
+#  QUERY MICRO-BATCHER
+QUERY_BATCH_WINDOW = float(os.getenv("QUERY_BATCH_WINDOW", "0.008"))
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "32"))
+
+class QueryEmbeddingBatcher:
+    """Coalesces queries arriving within a short window into one encoder call.
+
+    Single-query latency grows by at most one window, while concurrent
+    queries share a transformer forward pass instead of paying for a
+    batch of one each.
+    """
+
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: List[Tuple[str, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def embed(self, query: str) -> np.ndarray:
+        if self._task is None:
+            return await run_in_threadpool(get_query_embedding, query)
+        
+        fut = asyncio.get_running_loop().create_future()
+        self.pending.append((query, fut))
+        self._wakeup.set()
+        if len(self.pending) >= self.max_batch:
+            self._full.set()
+        return await fut
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Give concurrent requests one window to join, unless the batch already filled
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            
+            batch = self.pending[:self.max_batch]
+            self.pending = self.pending[self.max_batch:]
+            self._full.clear()
+            if len(self.pending) >= self.max_batch:
+                self._full.set()
+            if not self.pending:
+                self._wakeup.clear()
+            
+            batch = [(text, fut) for text, fut in batch if not fut.cancelled()]
+            if not batch:
+                continue
+            try:
+                if len(batch) == 1:
+                    embeddings = [await run_in_threadpool(get_query_embedding, batch[0][0])]
+                else:
+                    embeddings = await run_in_threadpool(get_query_embeddings, [text for text, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), embedding in zip(batch, embeddings):
+                if not fut.done():
+                    fut.set_result(embedding)
+
+query_batcher = QueryEmbeddingBatcher(QUERY_BATCH_WINDOW, QUERY_BATCH_MAX)
+
+#  SEMANTIC QUERY CACHE
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "300"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "256"))
+SEMANTIC_CACHE_USERS = int(os.getenv("SEMANTIC_CACHE_USERS", "1024"))
+
+class SemanticQueryCache:
+    """Per-user cache of Pinecone matches keyed by query hash and embedding.
+
+    A repeat of a cached query (same normalized text) is answered before it
+    is even embedded; a query whose cosine similarity to a cached one reaches
+    ``threshold`` reuses that query's matches and skips the Pinecone round
+    trip. Pinecone returns matches best first, so an entry fetched with a
+    larger ``top_k`` also answers smaller ones by slicing; every page of a
+    result list is served from the one cached fetch. Entries expire after
+    ``ttl`` seconds; least recently used entries
+    (and users) are evicted past the size limits.
+
+    The cache is per process, so each entry records the user's data
+    ``generation`` (from the shared registry database) it was fetched at;
+    a lookup at any other generation misses. /ingest and /user/flush bump
+    the generation, which invalidates the user's entries in every worker.
+    """
+
+    def __init__(self, threshold: float, ttl: float, max_entries: int, max_users: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_users = max_users
+        # user_id -> list of [query_hash, embedding, top_k, matches, created_at, generation],
+        # oldest use first
+        self._users: "OrderedDict[str, List[list]]" = OrderedDict()
+
+    def _entries(self, user_id: str, generation: int) -> List[list]:
+        entries = self._users.get(user_id)
+        if entries is None:
+            return []
+        self._users.move_to_end(user_id)
+        cutoff = time.monotonic() - self.ttl
+        entries[:] = [e for e in entries if e[4] >= cutoff and e[5] == generation]
+        return entries
+
+    def _best(self, entries: List[list], embedding: np.ndarray, top_k: int) -> Tuple[int, float]:
+        candidates = [i for i, e in enumerate(entries) if e[2] >= top_k]
+        if not candidates:
+            return -1, -1.0
+        sims = np.stack([entries[i][1] for i in candidates]) @ embedding
+        best = int(np.argmax(sims))
+        return candidates[best], float(sims[best])
+
+    def _hit(self, entries: List[list], idx: int, top_k: int) -> List[Any]:
+        entries.append(entries.pop(idx))
+        return entries[-1][3][:top_k]
+
+    def get_exact(self, user_id: str, query_hash: str, top_k: int,
+                  generation: int) -> Optional[List[Any]]:
+        entries = self._entries(user_id, generation)
+        for idx, e in enumerate(entries):
+            if e[0] == query_hash and e[2] >= top_k:
+                return self._hit(entries, idx, top_k)
+        return None
+
+    def get(self, user_id: str, embedding: np.ndarray, top_k: int,
+            generation: int) -> Optional[List[Any]]:
+        entries = self._entries(user_id, generation)
+        idx, sim = self._best(entries, embedding, top_k)
+        if idx < 0 or sim < self.threshold:
+            return None
+        return self._hit(entries, idx, top_k)
+
+    def put(self, user_id: str, query_hash: str, embedding: np.ndarray, top_k: int,
+            matches: List[Any], generation: int) -> None:
+        entries = self._entries(user_id, generation)
+        if user_id not in self._users:
+            self._users[user_id] = entries
+        idx, sim = self._best(entries, embedding, top_k)
+        if idx >= 0 and sim >= self.threshold:
+            # Near-duplicate query: refresh the existing entry rather than growing the cache
+            entries.pop(idx)
+        # A fetch with a larger top_k supersedes this query's smaller ones
+        entries[:] = [e for e in entries if e[0] != query_hash or e[2] > top_k]
+        entries.append([query_hash, embedding, top_k, matches, time.monotonic(), generation])
+        del entries[:-self.max_entries]
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        self._users.pop(user_id, None)
+
+semantic_cache = SemanticQueryCache(
+    SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_USERS
+)
+
+#  QUERY EMBEDDING CACHE (exact text, shared by all users)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+_query_embedding_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+def normalize_query(query: str) -> str:
+    # The MiniLM tokenizer is uncased and ignores runs of whitespace, so
+    # this normalization never changes the embedding
+    return " ".join(query.lower().split())
+
+async def embed_query(normalized_query: str, query_hash: str) -> np.ndarray:
+    """Embed a normalized query through the micro-batcher, memoizing by hash.
+
+    All cache bookkeeping happens between awaits on the event loop thread,
+    so no lock is needed.
+    """
+    embedding = _query_embedding_cache.get(query_hash)
+    if embedding is not None:
+        _query_embedding_cache.move_to_end(query_hash)
+        return embedding
+    embedding = await query_batcher.embed(normalized_query)
+    _query_embedding_cache[query_hash] = embedding
+    while len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+        _query_embedding_cache.popitem(last=False)
+    return embedding
+
+@app.on_event("startup")
+async def start_query_batcher():
+    query_batcher.start()
+
+@app.on_event("shutdown")
+async def stop_query_batcher():
+    await query_batcher.stop()
+
+@app.on_event("shutdown")
+def stop_cpu_pool():
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(cancel_futures=True)
+
+# Connections inherited from the gunicorn master; kept referenced so the child
+# never finalizes (and so closes or checkpoints) the master's SQLite handles
+_inherited_handles: List[Any] = []
+
+def reset_process_state() -> None:
+    """Reopen per-process resources after fork (gunicorn ``preload_app``).
+
+    The model weights loaded in the master stay shared copy-on-write; SQLite
+    connections, the Pinecone client and the ONNX Runtime thread pool must
+    not be shared across processes, so each worker opens its own. The
+    master never opens the data-plane index (PINECONE_CONNECT_AFTER_FORK),
+    so its first connection is made here.
+    """
+    global _embed_cache, _documents_db, pc, index
+    _inherited_handles.extend(h for h in (_embed_cache, _documents_db) if h is not None)
+    _embed_cache = open_embed_cache()
+    _documents_db = open_document_registry()
+    if pc is not None:
+        try:
+            pc = PineconeClient(api_key=PINECONE_API_KEY)
+            index = pc.Index(PINECONE_INDEX_NAME)
+        except Exception as e:
+            print(f" Pinecone reconnect failed: {e}")
+            pc = None
+            index = None
+    if isinstance(embedding_model, ORTSentenceEncoder):
+        embedding_model.open_session()
+
 # Pydantic models
 class QueryIn(BaseModel):
     query: str
@@ -265,6 +1026,72 @@ class PaginationInfo(BaseModel):
     has_next: bool
     has_previous: bool
 
+class IngestError(Exception):
+    """An upload that cannot be ingested; the message is returned to the client"""
+
+def _prepare_chunks(filename: str, file_path: str) -> List[str]:
+    """Extract and chunk an upload for /ingest, run in the threadpool"""
+    try:
+        text = extract_text_from_file(filename, file_path)
+    except Exception as e:
+        raise IngestError(f"Text extraction failed: {str(e)}")
+    if not text or len(text.strip()) < 20:
+        raise IngestError("No text extracted or file too small.")
+
+    # Chunk text (in a worker process for large documents)
+    if len(text) >= CHUNK_PARALLEL_MIN_CHARS and (os.cpu_count() or 1) > 1:
+        chunks = get_cpu_pool().submit(chunk_document, text).result()
+    else:
+        chunks = chunk_document(text)
+    
+    # Repeated boilerplate (headers, footers, citations) yields identical chunks;
+    # keep the first of each so it is embedded and stored only once
+    return list(dict.fromkeys(chunks))
+
+def _embed_batch(chunks: List[str]) -> np.ndarray:
+    try:
+        return get_embeddings(chunks)
+    except Exception as e:
+        raise IngestError(f"Embedding failed: {str(e)}")
+
+# Ingest concurrency primitives, created per worker inside its running event loop
+# (anyio 3.x limiters require it) by start_ingest_limit
+INGEST_LIMIT: Optional[CapacityLimiter] = None
+_upsert_slots: Optional[asyncio.Semaphore] = None
+
+@app.on_event("startup")
+async def start_ingest_limit():
+    global INGEST_LIMIT, _upsert_slots
+    INGEST_LIMIT = CapacityLimiter(INGEST_CONCURRENCY)
+    _upsert_slots = asyncio.Semaphore(UPSERT_CONCURRENCY)
+
+def save_upload(upload, user_id: str, filename: str) -> Tuple[str, str]:
+    """Copy the upload into UPLOAD_DIR and return (document_id, file_path).
+
+    The id is derived from the uploader, filename and content, so uploading
+    the same file again maps onto the same document: upsert overwrites its
+    vectors in place instead of adding a duplicate copy to the index.
+    """
+    digest = hashlib.sha256(f"{user_id}\0{filename}\0".encode("utf-8"))
+    tmp_path = os.path.join(UPLOAD_DIR, f".{os.urandom(8).hex()}.part")
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            while block := upload.read(UPLOAD_COPY_BUFFER):
+                size += len(block)
+                if size > MAX_UPLOAD_BYTES:
+                    raise IngestError("File too large. Maximum size is 50MB.")
+                digest.update(block)
+                f.write(block)
+        file_id = digest.hexdigest()[:32]
+        file_path = os.path.join(UPLOAD_DIR, f"{file_id}_{filename}")
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return file_id, file_path
+
 #  PINEcone INGEST ENDPOINT (UPDATED)
 @app.post("/ingest")
 async def ingest(
@@ -274,75 +1101,97 @@ async def ingest(
     if not index:
         return {"success": False, "error": "Pinecone not available"}
     
-    # Save file
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(UPLOAD_DIR, f"{file_id}_{file.filename}")
-    
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
-    if len(content) > 50 * 1024 * 1024:
-        return {"success": False, "error": "File too large. Maximum size is 50MB."}
-
-    text = extract_text_from_file(file.filename, content)
-    if not text or len(text.strip()) < 20:
-        return {"success": False, "error": "No text extracted or file too small."}
-
-    # Chunk text
-    chunks = smart_chunk_text(
-        text, 
-        method="sentence",
-        sentences_per_chunk=5,
-        overlap_sentences=2
-    )
-    
-    # Generate embeddings
+    # Stream the spooled upload to disk block by block; oversized files are
+    # rejected mid-copy without ever being held in memory
     try:
-        embeddings = get_embeddings(chunks)
-    except Exception as e:
-        return {"success": False, "error": f"Embedding failed: {str(e)}"}
-    
-    #  NEW PINEcone DATA FORMAT
-    vectors = []
-    for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-        vector_id = f"{current_user.user_id}_{file_id}_{i}"
+        file_id, file_path = await run_in_threadpool(
+            save_upload, file.file, current_user.user_id, file.filename
+        )
+    except IngestError as e:
+        return {"success": False, "error": str(e)}
+
+    # Bounded: each ingest holds a document's text and embeddings in memory
+    async with INGEST_LIMIT:
+        try:
+            chunks = await run_in_threadpool(_prepare_chunks, file.filename, file_path)
+        except IngestError as e:
+            return {"success": False, "error": str(e)}
         
-        metadata = {
-            "text": chunk,
-            "source": file.filename,
-            "chunk_index": i,
+        #  NEW PINEcone DATA FORMAT
+        # Per-file fields go to the document registry once; each vector carries only
+        # the ids Pinecone filters on plus its own text and position
+        previous = (await run_in_threadpool(lookup_documents, current_user.user_id, [file_id])).get(file_id)
+        base_metadata = {
             "user_id": current_user.user_id,
-            "username": current_user.username,
             "document_id": file_id,
-            "file_path": file_path,
-            "upload_time": datetime.utcnow().isoformat(),
-            "chunking_method": "sentence_based",
         }
+        id_prefix = f"{current_user.user_id}_{file_id}_"
         
-        vectors.append({
-            "id": vector_id,
-            "values": embedding,
-            "metadata": metadata
-        })
-    
-    #  NEW PINEcone UPSERT
-    try:
-        # Upsert in batches of 100
-        for i in range(0, len(vectors), 100):
-            batch = vectors[i:i + 100]
-            index.upsert(vectors=batch)
-        
-        return {
-            "success": True, 
-            "ingested_chunks": len(chunks), 
-            "file": file.filename,
-            "user_id": current_user.user_id,
-            "document_id": file_id
-        }
+        async def upsert_batch(start: int, embeddings: np.ndarray) -> None:
+            async with _upsert_slots:
+                # Embeddings stay a float32 matrix; only batches in flight become Python lists
+                batch = [
+                    {
+                        "id": f"{id_prefix}{start + j}",
+                        "values": embeddings[j].tolist(),
+                        "metadata": {**base_metadata, "text": chunks[start + j], "chunk_index": start + j},
+                    }
+                    for j in range(len(embeddings))
+                ]
+                await run_in_threadpool(index.upsert, vectors=batch)
         
-    except Exception as e:
-        return {"success": False, "error": f"Pinecone upload failed: {str(e)}"}
+        #  NEW PINEcone UPSERT
+        upserts = []
+        try:
+            # Embed one batch at a time and send each to Pinecone as soon as it is
+            # ready, so upload round trips overlap with embedding the next batch
+            for start in range(0, len(chunks), UPSERT_BATCH_SIZE):
+                embeddings = await run_in_threadpool(
+                    _embed_batch, chunks[start:start + UPSERT_BATCH_SIZE]
+                )
+                upserts.append(asyncio.create_task(upsert_batch(start, embeddings)))
+            await asyncio.gather(*upserts)
+            
+            # A re-upload that now chunks shorter leaves stale tail vectors behind
+            if previous and previous["chunk_count"] > len(chunks):
+                stale_ids = [f"{id_prefix}{i}" for i in range(len(chunks), previous["chunk_count"])]
+                for start in range(0, len(stale_ids), UPSERT_BATCH_SIZE):
+                    await run_in_threadpool(index.delete, ids=stale_ids[start:start + UPSERT_BATCH_SIZE])
+            
+            # Registered only once every vector is in place: a failed upload must not
+            # be listed, and a re-upload keeps the previous row (and its chunk count,
+            # which the stale-tail cleanup relies on) until it fully succeeds
+            await run_in_threadpool(register_document, {
+                "document_id": file_id,
+                "user_id": current_user.user_id,
+                "source": file.filename,
+                "username": current_user.username,
+                "file_path": file_path,
+                "upload_time": datetime.utcnow().isoformat(),
+                "chunking_method": "sentence_based",
+                "chunk_count": len(chunks),
+            })
+            
+            return {
+                "success": True, 
+                "ingested_chunks": len(chunks), 
+                "file": file.filename,
+                "user_id": current_user.user_id,
+                "document_id": file_id
+            }
+            
+        except IngestError as e:
+            return {"success": False, "error": str(e)}
+        except Exception as e:
+            return {"success": False, "error": f"Pinecone upload failed: {str(e)}"}
+        finally:
+            for task in upserts:
+                task.cancel()
+            await asyncio.gather(*upserts, return_exceptions=True)
+            # Even a partial upload changes what this user's queries should return,
+            # in every worker: the bump makes their cached entries miss
+            await run_in_threadpool(bump_user_generation, current_user.user_id)
+            semantic_cache.invalidate(current_user.user_id)
 
 #  PINEcone QUERY ENDPOINT (UPDATED)
 @app.post("/query")
@@ -353,23 +1202,42 @@ async def query(
     if not index:
         return {"success": False, "error": "Pinecone not available"}
     
+    normalized_query = normalize_query(q.query)
+    query_hash = hashlib.sha256(normalized_query.encode("utf-8")).hexdigest()
+    top_k = min(q.top_k or 50, 100)
+    # Read before querying Pinecone, so results fetched while an ingest or flush
+    # lands are cached under the old generation and never served after it
+    generation = await run_in_threadpool(user_generation, current_user.user_id)
+    
+    # A repeated query is answered before it is even embedded
+    matches = semantic_cache.get_exact(current_user.user_id, query_hash, top_k, generation)
+    
     # Generate query embedding
-    try:
-        query_embedding = get_query_embedding(q.query)
-    except Exception as e:
-        return {"success": False, "error": f"Query embedding failed: {str(e)}"}
+    if matches is None:
+        try:
+            query_embedding = await embed_query(normalized_query, query_hash)
+        except Exception as e:
+            return {"success": False, "error": f"Query embedding failed: {str(e)}"}
     
-    # NEW PINEcone QUERY
+    # NEW PINEcone QUERY (skipped when a near-identical query was answered recently)
     try:
-        results = index.query(
-            vector=query_embedding,
-            top_k=min(q.top_k or 50, 100),
-            filter={"user_id": {"$eq": current_user.user_id}},
-            include_metadata=True,
-            include_values=False
-        )
+        if matches is None:
+            matches = semantic_cache.get(current_user.user_id, query_embedding, top_k, generation)
+        if matches is None:
+            results = await run_in_threadpool(
+                index.query,
+                vector=query_embedding.tolist(),
+                top_k=top_k,
+                filter=_user_filter(current_user.user_id),
+                include_metadata=True,
+                include_values=False
+            )
+            matches = results.matches
+            semantic_cache.put(
+                current_user.user_id, query_hash, query_embedding, top_k, matches, generation
+            )
         
-        total_results = len(results.matches)
+        total_results = len(matches)
         
         # Pagination
         page_size = q.page_size or 10
@@ -380,12 +1248,17 @@ async def query(
         total_pages = (total_results + page_size - 1) // page_size if total_results > 0 else 1
         
         # Get paginated results
-        paginated_matches = results.matches[start_idx:end_idx]
+        paginated_matches = matches[start_idx:end_idx]
         
-        docs = []
-        for match in paginated_matches:
-            metadata = match.metadata
-            docs.append({
+        documents = await run_in_threadpool(
+            lookup_documents,
+            current_user.user_id,
+            [match.metadata.get("document_id") for match in paginated_matches],
+        )
+        
+        metadatas = [enrich_metadata(match.metadata, documents) for match in paginated_matches]
+        docs = [
+            {
                 "text": metadata.get("text", ""),
                 "metadata": metadata,
                 "distance": 1 - match.score,  # Convert similarity to distance
@@ -394,19 +1267,16 @@ async def query(
                 "source_link": f"/api/documents/{metadata.get('document_id', '')}",
                 "upload_time": metadata.get('upload_time', ''),
                 "chunk_number": metadata.get('chunk_index', 0) + 1
-            })
-        
-        context = "\n\n---\n\n".join([d["text"] for d in docs])
-        
-        if docs:
-            answer = f"Based on your documents, here's what I found (showing {len(docs)} of {total_results} relevant sources):\n\n{context}"
-        else:
-            answer = "I couldn't find any relevant information in your uploaded documents to answer this question."
+            }
+            for match, metadata in zip(paginated_matches, metadatas)
+        ]
         
-        return {
+        # Each chunk's text is sent once, in its document; the client assembles the
+        # answer from them. Returning the response directly skips jsonable_encoder,
+        # and orjson serializes the payload in C.
+        return FastJSONResponse({
             "query": q.query, 
             "documents": docs, 
-            "answer": answer,
             "user_id": current_user.user_id,
             "pagination": {
                 "current_page": current_page,
@@ -416,32 +1286,91 @@ async def query(
                 "has_next": current_page < total_pages,
                 "has_previous": current_page > 1
             }
-        }
+        })
         
     except Exception as e:
         return {"success": False, "error": f"Pinecone query failed: {str(e)}"}
 
 #  PINEcone DOCUMENT MANAGEMENT (UPDATED)
+# Placeholder query vector for metadata-only lookups; built once, never mutated
+_ZERO_VEC = [0.0] * 384  # Match embedding dimension
+
+async def scan_user_chunks(user_id: str) -> List[Any]:
+    """Every chunk vector of the user (up to 10000), metadata only"""
+    #  NEW PINEcone QUERY FOR ALL DOCUMENTS
+    # We need to query with a dummy vector to get all user documents
+    results = await run_in_threadpool(
+        index.query,
+        vector=_ZERO_VEC,
+        top_k=10000,
+        filter=_user_filter(user_id),
+        include_metadata=True
+    )
+    return results.matches
+
+async def backfill_legacy_documents(user_id: str) -> None:
+    """Copy the user's pre-registry documents into the registry (once per user).
+
+    Vectors ingested before the registry carry the per-file fields (source,
+    username, ...) themselves; registry-era vectors only carry the ids, so
+    they are skipped, including those of uploads that never completed.
+    """
+    legacy = {}
+    for match in await scan_user_chunks(user_id):
+        metadata = match.metadata
+        document_id = metadata.get("document_id")
+        if not document_id or "source" not in metadata:
+            continue
+        if document_id not in legacy:
+            legacy[document_id] = {
+                "document_id": document_id,
+                "user_id": user_id,
+                "source": metadata["source"],
+                "username": metadata.get("username"),
+                "file_path": metadata.get("file_path"),
+                "upload_time": metadata.get("upload_time"),
+                "chunking_method": metadata.get("chunking_method"),
+                "chunk_count": 0,
+            }
+        legacy[document_id]["chunk_count"] += 1
+    await run_in_threadpool(backfill_documents, user_id, list(legacy.values()))
+
 @app.get("/user/documents")
 async def get_user_documents(current_user: TokenData = Depends(get_current_user)):
-    """Get all documents for the current user from Pinecone"""
+    """Get all documents for the current user from the registry (or Pinecone)"""
     if not index:
         return {"success": False, "error": "Pinecone not available"}
     
     try:
-        #  NEW PINEcone QUERY FOR ALL DOCUMENTS
-        # We need to query with a dummy vector to get all user documents
-        dummy_vector = [0] * 384  # Match embedding dimension
+        if _documents_db is not None:
+            # The registry holds one row per document with its chunk count; documents
+            # from before it existed are copied in from Pinecone the first time
+            if not await run_in_threadpool(user_backfilled, current_user.user_id):
+                await backfill_legacy_documents(current_user.user_id)
+            registered = await run_in_threadpool(list_user_documents, current_user.user_id)
+            documents_list = [
+                {
+                    "filename": document["source"],
+                    "chunks": document["chunk_count"],
+                    "uploaded_by": document["username"] or "",
+                    "upload_time": document["upload_time"] or "",
+                    "document_id": document["document_id"],
+                }
+                for document in registered
+            ]
+            return {
+                "user_id": current_user.user_id,
+                "username": current_user.username,
+                "total_documents": len(documents_list),
+                "total_chunks": sum(d["chunks"] for d in documents_list),
+                "documents": documents_list
+            }
         
-        results = index.query(
-            vector=dummy_vector,
-            top_k=10000,
-            filter={"user_id": {"$eq": current_user.user_id}},
-            include_metadata=True
-        )
+        # Registry unavailable: aggregate the chunks' own metadata
+        matches = await scan_user_chunks(current_user.user_id)
         
         documents_by_id = {}
-        for match in results.matches:
+        for match in matches:
             metadata = match.metadata
             document_id = metadata.get("document_id")
             filename = metadata.get("source", "Unknown")
@@ -462,7 +1391,7 @@ async def get_user_documents(current_user: TokenData = Depends(get_current_user)
             "user_id": current_user.user_id,
             "username": current_user.username,
             "total_documents": len(documents_list),
-            "total_chunks": len(results.matches),
+            "total_chunks": len(matches),
             "documents": documents_list
         }
         
@@ -477,7 +1406,10 @@ async def flush_user_data(current_user: TokenData = Depends(get_current_user)):
     
     try:
         #  NEW PINEcone DELETE
-        index.delete(filter={"user_id": {"$eq": current_user.user_id}})
+        await run_in_threadpool(index.delete, filter=_user_filter(current_user.user_id))
+        await run_in_threadpool(delete_user_documents, current_user.user_id)
+        await run_in_threadpool(bump_user_generation, current_user.user_id)
+        semantic_cache.invalidate(current_user.user_id)
         
         return {
             "success": True, 
@@ -505,25 +1437,29 @@ async def root():
     }
 
 # Document provenance endpoints (simplified for now)
+async def find_document(user_id: str, document_id: str) -> Optional[dict]:
+    """Look a document up in the registry, falling back to its vectors' metadata"""
+    document = (await run_in_threadpool(lookup_documents, user_id, [document_id])).get(document_id)
+    if document:
+        return document
+    
+    # Documents ingested before the registry: read the shared fields off a chunk
+    results = await run_in_threadpool(
+        index.query,
+        vector=_ZERO_VEC,
+        top_k=1,
+        filter={**_user_filter(user_id), "document_id": {"$eq": document_id}},
+        include_metadata=True
+    )
+    return results.matches[0].metadata if results.matches else None
+
 @app.get("/api/documents/{document_id}")
 async def get_document_info(document_id: str, current_user: TokenData = Depends(get_current_user)):
     try:
-        # Query for documents with this document_id
-        dummy_vector = [0] * 384
-        results = index.query(
-            vector=dummy_vector,
-            top_k=1,
-            filter={
-                "user_id": {"$eq": current_user.user_id},
-                "document_id": {"$eq": document_id}
-            },
-            include_metadata=True
-        )
-        
-        if not results.matches:
+        metadata = await find_document(current_user.user_id, document_id)
+        if not metadata:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        metadata = results.matches[0].metadata
         return {
             "document_id": document_id,
             "filename": metadata.get("source", "Unknown"),
@@ -536,22 +1472,10 @@ async def get_document_info(document_id: str, current_user: TokenData = Depends(
 @app.get("/api/documents/{document_id}/download")
 async def download_document(document_id: str, current_user: TokenData = Depends(get_current_user)):
     try:
-        # Query to get file path
-        dummy_vector = [0] * 384
-        results = index.query(
-            vector=dummy_vector,
-            top_k=1,
-            filter={
-                "user_id": {"$eq": current_user.user_id},
-                "document_id": {"$eq": document_id}
-            },
-            include_metadata=True
-        )
-        
-        if not results.matches:
+        metadata = await find_document(current_user.user_id, document_id)
+        if not metadata:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        metadata = results.matches[0].metadata
         file_path = metadata.get("file_path")
         
         if not file_path or not os.path.exists(file_path):
@@ -0,0 +1,52 @@
+# backend/export_onnx.py - build step: export the embedding model to int8 ONNX
+#
+#   python export_onnx.py
+#
+# Run once per build (see railway.json) so the serving processes only load the
+# finished model from ONNX_MODEL_DIR and never download/export at startup.
+import os
+import platform
+import sys
+
+from dotenv import load_dotenv
+
+ONNX_QUANTIZED_FILE = "model_quantized.onnx"
+
+def _cpu_flags() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+def export_quantized_onnx(model_name: str, output_dir: str) -> None:
+    """Export the sentence-transformers model to ONNX and apply dynamic int8 quantization"""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    hub_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    ort_model = ORTModelForFeatureExtraction.from_pretrained(hub_id, export=True)
+    ort_model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(hub_id).save_pretrained(output_dir)
+
+    # Quantize for the instruction set this host actually has
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        qconfig = AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+    elif "avx512_vnni" in _cpu_flags():
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    else:
+        qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    quantizer = ORTQuantizer.from_pretrained(ort_model)
+    quantizer.quantize(save_dir=output_dir, quantization_config=qconfig)
+
+if __name__ == "__main__":
+    load_dotenv()
+    model_name = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+    output_dir = os.getenv("ONNX_MODEL_DIR", "onnx_model")
+    if os.path.exists(os.path.join(output_dir, ONNX_QUANTIZED_FILE)) and "--force" not in sys.argv:
+        print(f" ONNX model already exported to {output_dir} (use --force to redo)")
+    else:
+        print(f" Exporting {model_name} to ONNX (int8) in {output_dir}...")
+        export_quantized_onnx(model_name, output_dir)
+        print(" ONNX model exported successfully!")
@@ -6,12 +6,26 @@ bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
+# Embedding is compute-bound, so one worker per core; more only oversubscribes the CPU
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# app.py divides the cores between workers when sizing its inference thread pools
+os.environ["WEB_CONCURRENCY"] = str(workers)
 worker_class = "uvicorn.workers.UvicornWorker"
 worker_connections = 1000
 timeout = 300
 keepalive = 2
 
+# Load app.py (and the embedding model) once in the master; workers share the
+# weights copy-on-write instead of each loading its own copy
+preload_app = True
+# The master only checks the Pinecone index exists; its gRPC channel is opened per
+# worker in post_fork, since gRPC channels cannot be carried across fork()
+os.environ["PINECONE_CONNECT_AFTER_FORK"] = "1"
+
+def post_fork(server, worker):
+    import app
+    app.reset_process_state()
+
 # Logging
 accesslog = "-"
 errorlog = "-"
@@ -0,0 +1,87 @@
+# Stubs for the network- and model-backed imports, installed before app is imported,
+# so the suite runs offline:  cd backend && python -m pytest -q
+import hashlib
+import os
+import sys
+import tempfile
+import types
+
+import numpy as np
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_tmp = tempfile.mkdtemp(prefix="rag-app-tests-")
+os.environ.update({
+    "USE_ONNX": "false",
+    "PINECONE_API_KEY": "test",
+    "PINECONE_CONNECT_AFTER_FORK": "",
+    "UPLOAD_DIR": os.path.join(_tmp, "uploads"),
+    "EMBED_CACHE_PATH": os.path.join(_tmp, "emb_cache.db"),
+    "DOCUMENTS_DB_PATH": os.path.join(_tmp, "documents.db"),
+})
+
+class FakeSentenceTransformer:
+    """Deterministic stand-in for the MiniLM model: a fixed random vector per text"""
+
+    def __init__(self, name):
+        self.max_seq_length = 256
+        self.encoded = 0
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False,
+               convert_to_numpy=True, normalize_embeddings=False):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        self.encoded += len(texts)
+        out = np.empty((len(texts), 384), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+            out[i] = np.random.default_rng(seed).standard_normal(384)
+        if normalize_embeddings:
+            out /= np.linalg.norm(out, axis=1, keepdims=True)
+        return out[0] if single else out
+
+class FakeIndex:
+    """Only what the endpoints under test touch; nothing here is queried"""
+
+    def __init__(self):
+        self.vectors = {}
+
+    def upsert(self, vectors, **kwargs):
+        for v in vectors:
+            self.vectors[v["id"]] = v
+
+    def delete(self, ids=None, filter=None, **kwargs):
+        for i in ids or []:
+            self.vectors.pop(i, None)
+
+class FakePinecone:
+    def __init__(self, api_key=None, **kwargs):
+        pass
+
+    def list_indexes(self):
+        return types.SimpleNamespace(names=lambda: ["rag-documents"])
+
+    def Index(self, name, **kwargs):
+        return FakeIndex()
+
+_sentence_transformers = types.ModuleType("sentence_transformers")
+_sentence_transformers.SentenceTransformer = FakeSentenceTransformer
+sys.modules["sentence_transformers"] = _sentence_transformers
+
+_pinecone = types.ModuleType("pinecone")  # no pinecone.grpc: the app uses the REST client
+_pinecone.Pinecone = FakePinecone
+_pinecone.ServerlessSpec = lambda **kwargs: None
+sys.modules["pinecone"] = _pinecone
+
+# The PyTorch fallback only sizes torch's thread pools; don't require torch for that
+_torch = types.ModuleType("torch")
+_torch.set_num_threads = lambda n: None
+_torch.set_num_interop_threads = lambda n: None
+sys.modules.setdefault("torch", _torch)
+
+@pytest.fixture(scope="session")
+def app_module():
+    import app
+    return app
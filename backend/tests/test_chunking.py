@@ -0,0 +1,75 @@
+import pytest
+
+from text_processing import chunk_document, chunk_text, smart_sentence_chunk, smart_sentence_chunk_iter
+
+# Plain prose: no abbreviations or decimals, where Punkt and the regex split alike
+SAMPLE = (
+    "Pinecone stores one vector per chunk. Each chunk keeps its text in the metadata!\r\n"
+    "Queries are embedded with the same model. Are results filtered per user? "
+    "They are, by user_id. \"Quoted sentences\" start a new sentence too. "
+    "2024 was the year the index moved to serverless. The end."
+)
+SAMPLE_SENTENCES = [
+    "Pinecone stores one vector per chunk.",
+    "Each chunk keeps its text in the metadata!",
+    "Queries are embedded with the same model.",
+    "Are results filtered per user?",
+    "They are, by user_id.",
+    "\"Quoted sentences\" start a new sentence too.",
+    "2024 was the year the index moved to serverless.",
+    "The end.",
+]
+
+def old_chunk_text(text, chunk_size=800, overlap=150):
+    """chunk_text before the translate/stride rewrite"""
+    text = text.replace("\r\n", "\n")
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end - overlap
+    return chunks
+
+def old_sentence_chunks(sentences, sentences_per_chunk=5, overlap_sentences=2):
+    """The NLTK-era windowing over sent_tokenize's output"""
+    chunks = []
+    i = 0
+    while i < len(sentences):
+        chunks.append(" ".join(sentences[i:i + sentences_per_chunk]))
+        i += sentences_per_chunk - overlap_sentences
+    return chunks
+
+def test_chunk_text_matches_old_output():
+    text = ("Line one of a long document.\r\n" * 120) + "tail"
+    assert chunk_text(text) == old_chunk_text(text)
+    assert chunk_text(text, chunk_size=100, overlap=30) == old_chunk_text(text, 100, 30)
+    assert chunk_text("") == []
+    with pytest.raises(ValueError):
+        chunk_text(text, chunk_size=100, overlap=100)
+
+def test_sentence_chunks_match_old_output():
+    assert chunk_document(SAMPLE) == old_sentence_chunks(SAMPLE_SENTENCES)
+    for per_chunk, overlap in [(1, 0), (2, 1), (3, 0), (5, 4), (10, 2)]:
+        assert smart_sentence_chunk(SAMPLE, per_chunk, overlap) == \
+            old_sentence_chunks(SAMPLE_SENTENCES, per_chunk, overlap)
+
+def test_sentence_chunks_match_nltk():
+    nltk = pytest.importorskip("nltk")
+    try:
+        sentences = [s.strip() for s in nltk.sent_tokenize(SAMPLE) if s.strip()]
+    except LookupError:
+        pytest.skip("NLTK punkt data not installed")
+    assert sentences == SAMPLE_SENTENCES
+    assert chunk_document(SAMPLE) == old_sentence_chunks(sentences)
+
+def test_long_document_streams_the_same_chunks():
+    sentences = [f"Sentence number {i} is about topic {i % 7}." for i in range(1000)]
+    text = " ".join(sentences)
+    assert list(smart_sentence_chunk_iter(text)) == old_sentence_chunks(sentences)
+
+def test_single_sentence_falls_back_to_character_chunks():
+    text = "no sentence boundary here " * 100
+    assert chunk_document(text) == old_chunk_text(text)
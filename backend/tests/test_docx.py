@@ -0,0 +1,56 @@
+import zipfile
+
+import pytest
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+def write_docx(path, body, prolog=""):
+    xml = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>{prolog}'
+           f'<w:document xmlns:w="{W_NS}"><w:body>{body}</w:body></w:document>')
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("word/document.xml", xml)
+    return str(path)
+
+def test_runs_tabs_and_breaks(app_module, tmp_path):
+    body = (
+        # Tab stops in the paragraph properties are layout, not text
+        '<w:p><w:pPr><w:tabs><w:tab w:val="left" w:pos="720"/></w:tabs></w:pPr>'
+        '<w:r><w:t>Name</w:t><w:tab/><w:t>Value</w:t></w:r></w:p>'
+        '<w:p><w:r><w:t xml:space="preserve">line one</w:t><w:br/><w:t>line two</w:t></w:r>'
+        '<w:r><w:cr/><w:t>three</w:t></w:r></w:p>'
+        '<w:p/>'
+        '<w:p><w:r><w:t>after empty</w:t></w:r></w:p>'
+    )
+    text = app_module.extract_text_from_docx(write_docx(tmp_path / "a.docx", body))
+    assert text == "Name\tValue\nline one\nline two\nthree\n\nafter empty"
+
+def test_nested_paragraph_text_is_not_duplicated(app_module, tmp_path):
+    body = (
+        '<w:p><w:r><w:t>outer</w:t></w:r>'
+        '<w:r><w:pict><w:txbxContent><w:p><w:r><w:t>boxed</w:t></w:r></w:p>'
+        '</w:txbxContent></w:pict></w:r></w:p>'
+    )
+    text = app_module.extract_text_from_docx(write_docx(tmp_path / "a.docx", body))
+    assert text.split("\n") == ["outer", "boxed"]
+
+def test_rejects_external_entities(app_module, tmp_path):
+    secret = tmp_path / "secret.txt"
+    secret.write_text("TOP-SECRET")
+    prolog = f'<!DOCTYPE w:document [<!ENTITY xxe SYSTEM "file://{secret}">]>'
+    path = write_docx(tmp_path / "evil.docx", "<w:p><w:r><w:t>&xxe;</w:t></w:r></w:p>", prolog)
+    with pytest.raises(ValueError, match="DOCTYPE"):
+        app_module.extract_text_from_docx(path)
+
+def test_xxe_upload_is_refused(app_module, tmp_path):
+    from fastapi.testclient import TestClient
+
+    secret = tmp_path / "secret.txt"
+    secret.write_text("TOP-SECRET")
+    prolog = f'<!DOCTYPE w:document [<!ENTITY xxe SYSTEM "file://{secret}">]>'
+    path = write_docx(tmp_path / "evil.docx", "<w:p><w:r><w:t>&xxe;</w:t></w:r></w:p>", prolog)
+    with TestClient(app_module.app) as client, open(path, "rb") as f:
+        token = client.post("/auth/login", json={"username": "mallory"}).json()["access_token"]
+        r = client.post("/ingest", files={"file": ("evil.docx", f.read())},
+                        headers={"Authorization": f"Bearer {token}"})
+    assert r.json()["success"] is False
+    assert "TOP-SECRET" not in r.text
@@ -0,0 +1,42 @@
+import numpy as np
+
+def _unit_rows(n, seed=0):
+    v = np.random.default_rng(seed).standard_normal((n, 384)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+def test_int8_round_trip(app_module):
+    vectors = _unit_rows(64)
+    q = app_module.quantize_int8(vectors)
+    assert q.dtype == np.int8
+    assert np.abs(q).max(axis=1).tolist() == [127] * len(q)
+    restored = app_module.dequantize_int8(q)
+    assert restored.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(restored, axis=1), 1.0, atol=1e-5)
+    # Cosine to the original stays well above anything retrieval could notice
+    assert (np.sum(restored * vectors, axis=1) > 0.999).all()
+    # Re-quantizing a restored vector is lossless
+    np.testing.assert_array_equal(app_module.quantize_int8(restored), q)
+
+def test_cached_and_fresh_embeddings_are_identical(app_module):
+    model = app_module.embedding_model
+    texts = ["first chunk of text", "second chunk", "first chunk of text", "a third, longer chunk"]
+    encoded = model.encoded
+    fresh = app_module.get_embeddings(texts)
+    # The duplicate is only encoded once
+    assert model.encoded - encoded == 3
+    assert fresh.dtype == np.float32 and fresh.shape == (4, 384)
+    np.testing.assert_array_equal(fresh[0], fresh[2])
+
+    encoded = model.encoded
+    cached = app_module.get_embeddings(texts)
+    assert model.encoded == encoded
+    np.testing.assert_array_equal(cached, fresh)
+    np.testing.assert_allclose(np.linalg.norm(cached, axis=1), 1.0, atol=1e-5)
+
+def test_cache_persists_as_int8(app_module):
+    app_module.get_embeddings(["persisted chunk"])
+    rows = app_module._embed_cache.execute(
+        "SELECT model, length(vec) FROM emb_cache").fetchall()
+    assert rows
+    assert {row[0] for row in rows} == {app_module.EMBED_CACHE_MODEL_KEY}
+    assert {row[1] for row in rows} == {384}
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+@pytest.fixture
+def cache(app_module):
+    return app_module.SemanticQueryCache(threshold=0.97, ttl=60, max_entries=4, max_users=2)
+
+def _unit(seed):
+    v = np.random.default_rng(seed).standard_normal(384).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+MATCHES = [f"match-{i}" for i in range(10)]
+
+def test_exact_and_similar_hits(cache):
+    emb = _unit(0)
+    cache.put("u", "q1", emb, 10, MATCHES, generation=0)
+    assert cache.get_exact("u", "q1", 10, generation=0) == MATCHES
+    assert cache.get_exact("u", "q2", 10, generation=0) is None
+    assert cache.get("u", emb, 10, generation=0) == MATCHES
+    assert cache.get("u", _unit(1), 10, generation=0) is None
+    assert cache.get("other", emb, 10, generation=0) is None
+
+def test_larger_top_k_answers_smaller_by_slicing(cache):
+    emb = _unit(0)
+    cache.put("u", "q1", emb, 10, MATCHES, generation=0)
+    assert cache.get_exact("u", "q1", 3, generation=0) == MATCHES[:3]
+    assert cache.get("u", emb, 5, generation=0) == MATCHES[:5]
+    # ... but a smaller fetch cannot answer a larger one
+    assert cache.get_exact("u", "q1", 20, generation=0) is None
+    assert cache.get("u", emb, 20, generation=0) is None
+
+def test_larger_fetch_supersedes_smaller(cache):
+    emb = _unit(0)
+    cache.put("u", "q1", emb, 3, MATCHES[:3], generation=0)
+    cache.put("u", "q1", emb, 10, MATCHES, generation=0)
+    assert len(cache._users["u"]) == 1
+    assert cache.get_exact("u", "q1", 10, generation=0) == MATCHES
+
+def test_other_generation_misses(cache):
+    emb = _unit(0)
+    cache.put("u", "q1", emb, 10, MATCHES, generation=3)
+    assert cache.get_exact("u", "q1", 10, generation=4) is None
+    # Entries from the old generation are dropped, not resurrected
+    assert cache.get_exact("u", "q1", 10, generation=3) is None
+
+def test_entries_expire_after_ttl(app_module, cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app_module.time, "monotonic", lambda: now[0])
+    emb = _unit(0)
+    cache.put("u", "q1", emb, 10, MATCHES, generation=0)
+    now[0] += 59
+    assert cache.get_exact("u", "q1", 10, generation=0) == MATCHES
+    now[0] += 2
+    assert cache.get_exact("u", "q1", 10, generation=0) is None
+    assert cache.get("u", emb, 10, generation=0) is None
+
+def test_size_limits(cache):
+    for i in range(6):
+        cache.put("u", f"q{i}", _unit(i), 10, MATCHES, generation=0)
+    assert [e[0] for e in cache._users["u"]] == ["q2", "q3", "q4", "q5"]
+    cache.put("v", "q", _unit(10), 10, MATCHES, generation=0)
+    cache.put("w", "q", _unit(11), 10, MATCHES, generation=0)
+    assert list(cache._users) == ["v", "w"]
+
+def test_invalidate(cache):
+    cache.put("u", "q1", _unit(0), 10, MATCHES, generation=0)
+    cache.invalidate("u")
+    assert cache.get_exact("u", "q1", 10, generation=0) is None
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+@pytest.fixture
+def client(app_module):
+    with TestClient(app_module.app) as c:
+        yield c
+
+def _auth(client):
+    token = client.post("/auth/login", json={"username": "alice"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def _uploads(app_module):
+    return sorted(os.listdir(app_module.UPLOAD_DIR))
+
+def test_rejects_oversized_content_length(app_module, client):
+    body = b"x" * (app_module.MAX_UPLOAD_BYTES + app_module.MULTIPART_OVERHEAD_BYTES + 1)
+    r = client.post("/ingest", content=body, headers={"Content-Type": "application/octet-stream"})
+    assert r.status_code == 413
+    assert r.json() == {"success": False, "error": "File too large. Maximum size is 50MB."}
+
+def test_rejects_oversized_streamed_body(app_module, client):
+    before = _uploads(app_module)
+    block = b"x" * (1 << 20)
+    blocks = app_module.MAX_UPLOAD_BYTES // len(block) + 2
+
+    def body():
+        yield b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.txt\"\r\n\r\n"
+        for _ in range(blocks):
+            yield block
+
+    # A generator body goes out chunked, with no Content-Length to check up front
+    r = client.post("/ingest", content=body(), headers={
+        "Content-Type": "multipart/form-data; boundary=b", **_auth(client)})
+    assert r.status_code == 413
+    assert r.json()["success"] is False
+    assert _uploads(app_module) == before
+
+def test_rejects_file_over_cap_within_multipart_allowance(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, "MAX_UPLOAD_BYTES", 1024)
+    before = _uploads(app_module)
+    r = client.post("/ingest", files={"file": ("big.txt", b"x" * 2048, "text/plain")},
+                    headers=_auth(client))
+    assert r.status_code == 200
+    assert r.json() == {"success": False, "error": "File too large. Maximum size is 50MB."}
+    # The partial copy is removed
+    assert _uploads(app_module) == before
+
+def test_small_upload_passes(app_module, client):
+    r = client.post("/ingest", files={"file": ("notes.txt", b"Short note. Nothing else.", "text/plain")},
+                    headers=_auth(client))
+    assert r.status_code == 200
+    assert r.json()["success"] is True
@@ -0,0 +1,98 @@
+# backend/text_processing.py - CPU-bound ingest stages run in the process pool
+#
+# Kept free of the model, Pinecone and FastAPI so pool workers (started from a
+# forkserver, which re-imports what they run) only load what they need.
+import re
+import threading
+from collections import deque
+from typing import Iterator, List, Tuple
+
+try:
+    import fitz  # PyMuPDF (AGPL-3.0; without it PDFs fall back to PyPDF2)
+except ImportError:
+    fitz = None
+
+# PyMuPDF is not thread-safe: at most one thread per process may use it at a time
+FITZ_LOCK = threading.Lock()
+
+def _extract_pdf_pages(args: Tuple[str, int, int, bool]) -> List[str]:
+    """Pool worker: open the saved PDF once and extract a contiguous page range"""
+    path, start, stop, use_mupdf = args
+    if use_mupdf:
+        with FITZ_LOCK, fitz.open(path) as doc:
+            return [doc.load_page(i).get_text("text") for i in range(start, stop)]
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+# Deletes carriage returns in one C-level translate pass
+_CRLF_TABLE = str.maketrans({"\r": None})
+
+def chunk_text(text: str, chunk_size: int = 800, overlap: int = 150) -> List[str]:
+    text = text.translate(_CRLF_TABLE)
+    stride = chunk_size - overlap
+    if stride <= 0:
+        raise ValueError("overlap must be smaller than chunk_size")
+    windows = (text[i:i + chunk_size].strip() for i in range(0, len(text), stride))
+    return [chunk for chunk in windows if chunk]
+
+# Sentence boundary: terminal punctuation, whitespace, then a capital, digit or quote.
+# Runs in the C regex engine instead of NLTK's pickled Punkt model.
+_SENT_RE = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"\'])')
+
+def iter_sentences(text: str) -> Iterator[str]:
+    start = 0
+    for m in _SENT_RE.finditer(text):
+        sentence = text[start:m.start()].strip()
+        if sentence:
+            yield sentence
+        start = m.end()
+    sentence = text[start:].strip()
+    if sentence:
+        yield sentence
+
+def smart_sentence_chunk_iter(text: str, sentences_per_chunk: int = 5,
+                              overlap_sentences: int = 2) -> Iterator[str]:
+    """Yield chunks of ``sentences_per_chunk`` sentences, ``overlap_sentences`` apart.
+
+    Only a sliding window of sentences is held, never the document's full
+    sentence list; the trailing chunks may be shorter.
+    """
+    step = sentences_per_chunk - overlap_sentences
+    if step <= 0:
+        raise ValueError("overlap_sentences must be smaller than sentences_per_chunk")
+    window = deque(maxlen=sentences_per_chunk)
+    next_start = 0
+    seen = 0
+    for sentence in iter_sentences(text):
+        window.append(sentence)
+        seen += 1
+        if seen == next_start + sentences_per_chunk:
+            yield " ".join(window)
+            next_start += step
+    # Chunks starting in the last few sentences run to the end of the text
+    while next_start < seen:
+        tail = list(window)
+        yield " ".join(tail[next_start - (seen - len(tail)):])
+        next_start += step
+
+def smart_sentence_chunk(text: str, sentences_per_chunk: int = 5, overlap_sentences: int = 2) -> List[str]:
+    # A boundary match always has text on both sides, so no match means at most one sentence
+    if _SENT_RE.search(text) is None:
+        return chunk_text(text)
+    return list(smart_sentence_chunk_iter(text, sentences_per_chunk, overlap_sentences))
+
+def smart_chunk_text(text: str, method: str = "sentence", **kwargs) -> List[str]:
+    if method == "sentence":
+        return smart_sentence_chunk(text, **kwargs)
+    else:
+        return chunk_text(text, **kwargs)
+
+def chunk_document(text: str) -> List[str]:
+    """Chunking used for ingested documents (module-level so pool workers can run it)"""
+    return smart_chunk_text(
+        text, 
+        method="sentence",
+        sentences_per_chunk=5,
+        overlap_sentences=2
+    )
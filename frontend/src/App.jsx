@@ -138,8 +138,20 @@ export default function App() {
       });
       
       console.log("Full response:", res.data);
-      setAnswer(res.data.answer);
-      setDocs(res.data.documents || []);
+      if (res.data.error) {
+        setAnswer("❌ Error: " + res.data.error);
+        return;
+      }
+      const documents = res.data.documents || [];
+      const totalResults = res.data.pagination?.total_results ?? documents.length;
+      // 🆕 The answer is assembled here from the returned chunks instead of being sent twice
+      setAnswer(
+        documents.length
+          ? `Based on your documents, here's what I found (showing ${documents.length} of ${totalResults} relevant sources):\n\n` +
+              documents.map((d) => d.text).join("\n\n---\n\n")
+          : "I couldn't find any relevant information in your uploaded documents to answer this question."
+      );
+      setDocs(documents);
       
       // 🆕 Set pagination info
       if (res.data.pagination) {